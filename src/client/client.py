@@ -4,20 +4,32 @@
 # Use of this source code is governed by the GNU General Public License
 # version 3 (or any later version). See the file COPYING for details.
 
+import json
 import struct
 import sys
+import time
 
 from proto import protocol_pb2 as ghack_pb2
 import netclient
 import messages
+from latency import LatencyTracker
 from debug import debug
-from game.objects import Vector
 
 """
 Client:
     Holds a client connection to the game server. 
 """
 
+# Seconds between Move messages until the server tick rate is estimated
+MOVE_INTERVAL = 0.1
+# Range the estimated tick interval is clamped to for pacing moves
+MIN_MOVE_INTERVAL = 0.02
+MAX_MOVE_INTERVAL = 0.5
+# Movement input that couldn't be sent within this many ticks is dropped
+STALE_MOVE_TICKS = 2
+# Seconds between writes of the stats file
+STATS_INTERVAL = 1.0
+
 class Client(object):
     def __init__(self, game):
         self.game = game
@@ -25,16 +37,75 @@ class Client(object):
         self.handler = None
         self.version = 1
         self.connected = False
+        self.last_move = 0
+        self.moves_dropped = 0
+        self.input_latency = 0 # last key press to send latency, in seconds
+        self.input_latency_avg = 0
+        self.latency = LatencyTracker()
+        self.stats_file = None
+        self.last_stats = 0
 
     def run(self):
         """Start the client connection"""
         self.connect()
 
+    def move_interval(self):
+        """Seconds between Move messages, paced to the server tick rate"""
+        tick = self.latency.tick_interval()
+        if tick is None:
+            return MOVE_INTERVAL
+        return min(max(tick, MIN_MOVE_INTERVAL), MAX_MOVE_INTERVAL)
+
     def update(self, elapsed_seconds):
         """Runs every frame"""
+        now = time.time()
+        interval = self.move_interval()
         if self.game.direction.len_squared() > 0:
-            self.send(messages.move(self.game.direction))
-            self.game.direction = Vector()
+            if now - self.game.direction_time > interval * STALE_MOVE_TICKS:
+                self.game.take_direction()
+                self.moves_dropped += 1
+                debug("Dropped stale move (%d total)" % self.moves_dropped)
+            elif now - self.last_move >= interval:
+                direction, pressed = self.game.take_direction()
+                self.send(messages.move(direction))
+                self.latency.move_sent(now, direction)
+                self.last_move = now
+                self.input_latency = now - pressed
+                self.input_latency_avg += (self.input_latency -
+                        self.input_latency_avg) * 0.1
+                debug("Input latency %.1fms (avg %.1fms)" % (
+                    self.input_latency * 1000, self.input_latency_avg * 1000))
+
+        self.game.set_latency(self.latency.rtt.percentiles(),
+                self.latency.tick_interval())
+        if self.stats_file and now - self.last_stats >= STATS_INTERVAL:
+            self.write_stats()
+            self.last_stats = now
+
+    def stats(self):
+        """Returns network and input statistics as a dict"""
+        stats = self.latency.as_dict()
+        stats['input_latency'] = self.input_latency
+        stats['input_latency_avg'] = self.input_latency_avg
+        stats['moves_dropped'] = self.moves_dropped
+        stats['entity_cache'] = self.game.cache.as_dict()
+        if self.conn:
+            stats['backlog'] = self.conn.backlog()
+            stats['catchup_batches'] = self.conn.catchup_batches
+            stats['skipped_superseded'] = self.conn.skipped_superseded
+            stats['skipped_removed'] = self.conn.skipped_removed
+            stats['fast_decoded'] = self.conn.pipeline.fast_decoded
+            stats['deferred'] = self.conn.pipeline.deferred
+        return stats
+
+    def write_stats(self):
+        """Write stats() as JSON to the stats file"""
+        try:
+            with open(self.stats_file, 'w') as f:
+                json.dump(self.stats(), f, indent=2, sort_keys=True)
+        except IOError, e:
+            print >> sys.stderr, "Failed to write stats:", e
+            self.stats_file = None
 
     def handle(self, msg):
         """
@@ -48,6 +119,13 @@ class Client(object):
             debug("No handler for message, ignoring")
 
 
+    def wants(self, msg_type):
+        """Whether any handler does anything with msg_type. Doesn't look
+        at the current handler, since messages are decoded ahead of the
+        handler switching over.
+        """
+        return msg_type in HANDLED_TYPES
+
     def connect(self):
         """Do the client-server handshake"""
         connect = messages.connect(self.version)
@@ -60,6 +138,8 @@ class Client(object):
                 "Client disconnected")
         self.handler = None
         self.send(disconnect)
+        if self.stats_file:
+            self.write_stats()
 
         self.conn.close()
 
@@ -158,7 +238,13 @@ class GameHandler(Handler):
 
     def handle_update(self, client, update):
         args = {'id': update.id, 'state_id': update.state_id}
-        args['value'] = messages.unwrap_state(update.value)
+        if isinstance(update, messages.StateUpdate):
+            args['value'] = update.value
+        else:
+            args['value'] = messages.unwrap_state(update.value)
+        client.latency.update_received(client.conn.received)
+        if update.state_id == 'Position' and update.id == client.game.player:
+            client.latency.position_updated(client.conn.received, args['value'])
         client.game.update_entity(**args)
 
     def handle_assign_control(self, client, assign_control):
@@ -175,3 +261,7 @@ class GameHandler(Handler):
                 'vuid': combat_hit.victim_uid, 'vname': combat_hit.victim_name,
                 'damage': combat_hit.damage}
         client.game.combat_hit(**args)
+
+HANDLED_TYPES = frozenset(t
+        for handler in [ConnectHandler, LoginResultHandler, GameHandler]
+        for t in handler.handlers.keys() + handler.expected_types)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Measures how responsive the server is from the client side: the round
+trip from sending a Move until the controlled entity's Position changes,
+and the interval between the server's bursts of updates (its tick).
+"""
+
+from collections import deque
+
+# Number of recent samples kept by a RollingHistogram
+SAMPLES = 256
+# Upper bucket edges in seconds, the last bucket catches everything else
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+# Moves not echoed within this many seconds are assumed to have failed
+MAX_PENDING_AGE = 2.0
+# Updates arriving within this many seconds belong to the same tick
+TICK_GAP = 0.005
+# Gaps between ticks longer than this, or than TICK_OUTLIER times the
+# current estimate, are the world being idle rather than a tick
+MAX_TICK_INTERVAL = 1.0
+TICK_OUTLIER = 4
+
+def _explains(direction, old, new):
+    """Whether a move in direction could have taken old to new"""
+    for step, a, b in zip((direction.x, direction.y, direction.z), old, new):
+        if a != b and cmp(step, 0) != cmp(b, a):
+            return False
+    return True
+
+class RollingHistogram(object):
+    """Keeps the most recent samples and computes percentiles over them"""
+    def __init__(self, size=SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self._sorted = None
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self._sorted = None
+
+    def percentile(self, pct):
+        """Returns the pct (0-100) percentile, or None without samples"""
+        if not self.samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        index = int(round(pct / 100.0 * (len(self._sorted) - 1)))
+        return self._sorted[index]
+
+    def percentiles(self):
+        """Returns (p50, p95, p99), or None without samples"""
+        if not self.samples:
+            return None
+        return (self.percentile(50), self.percentile(95),
+                self.percentile(99))
+
+    def buckets(self):
+        counts = [0] * (len(BUCKETS) + 1)
+        for value in self.samples:
+            i = 0
+            while i < len(BUCKETS) and value > BUCKETS[i]:
+                i += 1
+            counts[i] += 1
+        return counts
+
+    def as_dict(self):
+        pcts = self.percentiles() or (None, None, None)
+        return {'count': self.count, 'window': len(self.samples),
+                'p50': pcts[0], 'p95': pcts[1], 'p99': pcts[2],
+                'bucket_edges': BUCKETS, 'buckets': self.buckets()}
+
+class LatencyTracker(object):
+    def __init__(self):
+        self.pending = deque() # (send time, direction) of moves not yet echoed
+        self.rtt = RollingHistogram()
+        self.ticks = RollingHistogram()
+        self.position = None
+        self.last_update = None
+        self.last_tick = None # arrival time of the first update of a tick
+        self.moves_lost = 0
+
+    def _expire(self, now):
+        while self.pending and now - self.pending[0][0] > MAX_PENDING_AGE:
+            self.pending.popleft()
+            self.moves_lost += 1
+
+    def move_sent(self, now, direction):
+        self._expire(now)
+        self.pending.append((now, direction))
+
+    def position_updated(self, received, pos):
+        """The controlled entity's Position arrived at time received"""
+        position = (pos.x, pos.y, pos.z)
+        if position == self.position:
+            return
+        last, self.position = self.position, position
+        self._expire(received)
+        # Match the oldest move sent before the update arrived. Older moves
+        # that can't explain the change (into walls, say) got no echo.
+        while self.pending and self.pending[0][0] <= received:
+            sent, direction = self.pending.popleft()
+            if last is None or _explains(direction, last, position):
+                self.rtt.add(received - sent)
+                return
+            self.moves_lost += 1
+
+    def update_received(self, received):
+        """Any UpdateState arrived at time received"""
+        if self.last_update is None or received - self.last_update > TICK_GAP:
+            if self.last_tick is not None:
+                gap = received - self.last_tick
+                estimate = self.tick_interval()
+                if gap <= MAX_TICK_INTERVAL and (estimate is None or
+                        gap <= estimate * TICK_OUTLIER):
+                    self.ticks.add(gap)
+            self.last_tick = received
+        self.last_update = received
+
+    def tick_interval(self):
+        """Median spacing of the server's ticks, or None if unknown"""
+        return self.ticks.percentile(50)
+
+    def as_dict(self):
+        return {'rtt': self.rtt.as_dict(), 'tick': self.ticks.as_dict(),
+                'moves_pending': len(self.pending),
+                'moves_lost': self.moves_lost}
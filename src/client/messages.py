@@ -12,6 +12,48 @@ from game.objects import Vector
 Contains convenience functions to create the various protocol buffer messages
 """
 
+class StateUpdate(object):
+    """An UpdateState decoded straight from the wire, with its value
+    already unwrapped. Stands in for both the Message and the UpdateState
+    it contains.
+    """
+    __slots__ = ('id', 'state_id', 'value')
+    type = ghack_pb2.Message.UPDATESTATE
+
+    def __init__(self, id, state_id, value):
+        self.id = id
+        self.state_id = state_id
+        self.value = value
+
+    @property
+    def update_state(self):
+        return self
+
+    def __str__(self):
+        return "UpdateState id=%d state_id=%r value=%r" % (self.id,
+                self.state_id, self.value)
+
+class LazyMessage(object):
+    """A Message that is only parsed once something reads its contents"""
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+        self._msg = None
+
+    def parse(self):
+        if self._msg is None:
+            self._msg = ghack_pb2.Message()
+            self._msg.ParseFromString(self.data)
+        return self._msg
+
+    def __getattr__(self, name):
+        return getattr(self.parse(), name)
+
+    def __str__(self):
+        # Only ever logged, so don't parse just for that
+        return "Unparsed %s message (%d bytes)" % (
+                MESSAGE_TYPES.get(self.type, self.type), len(self.data))
+
 def unwrap(msg):
     """Unwraps a Message"""
     return getattr(msg, MESSAGE_TYPES[msg.type])
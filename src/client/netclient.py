@@ -11,13 +11,18 @@ ClientState is a class that keeps data in sync with the server for
 import sys
 import time
 import struct
+from collections import deque
 
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ClientEndpoint
 from twisted.internet.protocol import Protocol, ClientFactory
 
-from proto import protocol_pb2 as ghack_pb2
 from states import Entity
+from pipeline import DecodePipeline, collapse
+from debug import debug
+
+# Backlog size above which superseded updates are skipped to catch up
+CATCHUP_THRESHOLD = 1024
 
 def connect(host, port, on_connected):
     """Create a GhackProtocol connection and fire on_connected"""
@@ -47,39 +52,99 @@ class GhackProtocol(Protocol):
     def __init__(self):
         self._buffer = ''
         self.callback = None
+        self.pipeline = DecodePipeline()
+        self.paused = False
+        self.received = None # arrival time of the message being handled
+        self.ready = deque() # decoded messages waiting to be dispatched
+        self.catching_up = False
+        self.catchup_batches = 0
+        self.skipped_superseded = 0
+        self.skipped_removed = 0
 
     def dataReceived(self, data):
         self._buffer += data
+        self._queue_frames()
+
+    def connectionLost(self, reason):
+        self.pipeline.stop()
 
-        # flush the buffer of messages to send
-        while self.callback:
-            msg = self.get_message()
-            if not msg:
-                return
+    def call_later(self, time, fn):
+        reactor.callLater(time, fn)
+
+    def _queue_frames(self):
+        """Move complete frames from the buffer onto the decode pipeline,
+        pausing the transport if the pipeline is full. Returns False if
+        it filled up."""
+        now = time.time()
+        offset = 0
+        queued = True
+        while len(self._buffer) - offset >= 2:
+            msg_len = struct.unpack_from('H', self._buffer, offset)[0]
+            end = offset + 2 + msg_len
+            if len(self._buffer) < end:
+                break
+            if not self.pipeline.put(now, self._buffer[offset + 2:end]):
+                if not self.paused:
+                    self.transport.pauseProducing()
+                    self.paused = True
+                queued = False
+                break
+            offset = end
+
+        self._buffer = self._buffer[offset:]
+        return queued
+
+    def pump(self, budget):
+        "Dispatches decoded messages from the server for up to budget seconds"
+        deadline = time.time() + budget
+        while self.callback and time.time() < deadline:
+            # Decode errors come out of _refill, they close us down too
             try:
+                if not self.ready:
+                    self._refill()
+                    if not self.ready:
+                        break
+                self.received, msg = self.ready.popleft()
                 self.callback(msg)
             except:
                 self.close()
                 raise
 
-    def call_later(self, time, fn):
-        reactor.callLater(time, fn)
-
-    def get_message(self):
-        "Dispatches the next message from the server (non-blocking)"
-        if len(self._buffer) <= 2:
-            return None
-
-        msg_len = struct.unpack('H', self._buffer[:2])[0]
-        if len(self._buffer) < 2 + msg_len:
-            return None
-
-        msg = ghack_pb2.Message()
-        msg.ParseFromString(self._buffer[2:msg_len + 2])
-
-        self._buffer = self._buffer[2 + msg_len:]
-
-        return msg
+        if self.paused and self.backlog() < self.pipeline.max_frames / 2:
+            if self._queue_frames():
+                self.paused = False
+                self.transport.resumeProducing()
+
+    def backlog(self):
+        """Number of messages received but not dispatched yet"""
+        return self.pipeline.backlog() + len(self.ready)
+
+    def _refill(self):
+        """Fetch decoded messages to dispatch. When the backlog is over
+        CATCHUP_THRESHOLD, everything decoded is fetched at once and
+        superseded updates are collapsed away.
+        """
+        backlog = self.backlog()
+        if not self.catching_up and backlog > CATCHUP_THRESHOLD:
+            self.catching_up = True
+            debug("Catching up, backlog of %d messages" % backlog)
+        elif self.catching_up and backlog < CATCHUP_THRESHOLD / 2:
+            self.catching_up = False
+            debug("Caught up after %d batches, skipped %d superseded and "
+                    "%d removed updates" % (self.catchup_batches,
+                        self.skipped_superseded, self.skipped_removed))
+
+        if not self.catching_up:
+            item = self.pipeline.get()
+            if item:
+                self.ready.append(item)
+            return
+
+        kept, superseded, removed = collapse(self.pipeline.get_many(backlog))
+        self.ready.extend(kept)
+        self.catchup_batches += 1
+        self.skipped_superseded += superseded
+        self.skipped_removed += removed
 
     def send_bytes(self, byte_buffer):
         self.transport.write(byte_buffer)
@@ -87,4 +152,3 @@ class GhackProtocol(Protocol):
     def close(self):
         reactor.stop()
 
-
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Decodes raw message frames off the reactor thread. Frames go onto a
+bounded queue, a worker thread parses them, and the reactor picks the
+decoded messages back up when it has time to apply them.
+"""
+
+import sys
+import threading
+import Queue
+
+from proto import protocol_pb2 as ghack_pb2
+import messages
+import wire
+
+# Frames (and decoded messages) held before the producer has to wait
+MAX_FRAMES = 4096
+
+def collapse(items):
+    """Collapse a backlog of (received, msg) pairs so only the last
+    UpdateState per (entity id, state id) is kept, and updates for an
+    entity that is removed or re-added later in the backlog are dropped.
+    All other messages are kept in order.
+
+    Returns (kept, superseded, removed) where the last two count the
+    updates skipped for each reason.
+    """
+    kept = []
+    seen = set()
+    gone = set() # entities removed or replaced later in the backlog
+    superseded = removed = 0
+    for item in reversed(items):
+        msg = item[1]
+        if msg.type == ghack_pb2.Message.UPDATESTATE:
+            update = msg.update_state
+            if update.id in gone:
+                removed += 1
+                continue
+            key = (update.id, update.state_id)
+            if key in seen:
+                superseded += 1
+                continue
+            seen.add(key)
+        elif msg.type == ghack_pb2.Message.REMOVEENTITY:
+            gone.add(msg.remove_entity.id)
+        elif msg.type == ghack_pb2.Message.ADDENTITY:
+            # Adding an entity replaces it, earlier states are lost anyway
+            gone.add(msg.add_entity.id)
+        kept.append(item)
+    kept.reverse()
+    return kept, superseded, removed
+
+class DecodePipeline(object):
+    def __init__(self, max_frames=MAX_FRAMES):
+        self.max_frames = max_frames
+        self.frames = Queue.Queue(max_frames)
+        self.decoded = Queue.Queue(max_frames)
+        self.wanted = None # predicate for message types worth parsing
+        self.fast_decoded = 0
+        self.deferred = 0
+        self.worker = threading.Thread(target=self._work, name='decoder')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def put(self, received, frame):
+        """Queue a raw frame received at the given time. Returns False
+        if the queue is full and the frame was not taken.
+        """
+        try:
+            self.frames.put_nowait((received, frame))
+            return True
+        except Queue.Full:
+            return False
+
+    def get(self):
+        """Returns the next (received, msg) pair, or None if nothing has
+        been decoded yet. Re-raises any error hit while decoding.
+        """
+        try:
+            received, msg, error = self.decoded.get_nowait()
+        except Queue.Empty:
+            return None
+        if error:
+            raise error[0], error[1], error[2]
+        return received, msg
+
+    def get_many(self, limit):
+        """Returns up to limit decoded (received, msg) pairs"""
+        items = []
+        while len(items) < limit:
+            item = self.get()
+            if not item:
+                break
+            items.append(item)
+        return items
+
+    def backlog(self):
+        """Number of frames waiting to be decoded or applied"""
+        return self.frames.qsize() + self.decoded.qsize()
+
+    def stop(self):
+        try:
+            self.frames.put_nowait(None)
+        except Queue.Full:
+            pass # the worker is a daemon, it will die with us
+
+    def decode(self, frame):
+        """Decode a frame, only parsing it fully if the message type is
+        wanted. Unwanted messages are parsed later if anything reads them.
+        """
+        msg_type = wire.peek_type(frame)
+        if msg_type == ghack_pb2.Message.UPDATESTATE and not wire.NATIVE_PROTOBUF:
+            update = wire.decode_update_state(frame)
+            if update:
+                self.fast_decoded += 1
+                return update
+        if msg_type is not None and self.wanted and not self.wanted(msg_type):
+            self.deferred += 1
+            return messages.LazyMessage(msg_type, frame)
+
+        msg = ghack_pb2.Message()
+        msg.ParseFromString(frame)
+        return msg
+
+    def _work(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            received, frame = item
+            try:
+                self.decoded.put((received, self.decode(frame), None))
+            except Exception:
+                self.decoded.put((received, None, sys.exc_info()))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Reads the protocol buffer wire format directly, for the few places where
+building a full Message is too much work: finding out the type of a
+frame, and decoding UpdateState, by far the most common message.
+"""
+
+import struct
+
+from proto import protocol_pb2 as ghack_pb2
+try:
+    from google.protobuf.internal import api_implementation
+    # The C++ backend parses faster than decoding by hand in Python
+    NATIVE_PROTOBUF = api_implementation.Type() != 'python'
+except ImportError:
+    NATIVE_PROTOBUF = False
+
+import messages
+from game.objects import Vector
+
+# A serialized Vector3 after its length: three tagged doubles
+VECTOR3_STRUCT = struct.Struct('<dxdxd')
+
+# Wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH = 2
+FIXED32 = 5
+
+class WireError(Exception):
+    pass
+
+def read_varint(data, pos):
+    """Returns the varint at data[pos] and the position after it"""
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise WireError("Truncated varint")
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+
+def read_int32(data, pos):
+    """Like read_varint, but negative int32s come out negative"""
+    value, pos = read_varint(data, pos)
+    if value & (1 << 63):
+        value -= 1 << 64
+    return int(value), pos
+
+def skip_field(data, pos, wire_type):
+    """Returns the position after a field's value"""
+    if wire_type == VARINT:
+        return read_varint(data, pos)[1]
+    elif wire_type == FIXED64:
+        return pos + 8
+    elif wire_type == LENGTH:
+        length, pos = read_varint(data, pos)
+        return pos + length
+    elif wire_type == FIXED32:
+        return pos + 4
+    raise WireError("Unsupported wire type %d" % wire_type)
+
+def fields(data, pos=0, end=None):
+    """Yields (field number, wire type, value position) for each field in
+    data[pos:end]. Skips over values not consumed by the caller.
+    """
+    if end is None:
+        end = len(data)
+    while pos < end:
+        tag, pos = read_varint(data, pos)
+        yield tag >> 3, tag & 7, pos
+        pos = skip_field(data, pos, tag & 7)
+
+def peek_type(frame):
+    """Returns the type of a serialized Message without parsing it, or
+    None if it has no type
+    """
+    # Serializers write the type first, and it fits in one byte
+    if frame[:1] == '\x08' and frame[1:2] and frame[1] < '\x80':
+        return ord(frame[1])
+    data = bytearray(frame)
+    try:
+        for number, wire_type, pos in fields(data):
+            if number == 1 and wire_type == VARINT:
+                return read_varint(data, pos)[0]
+    except WireError:
+        pass
+    return None
+
+def _length(data, pos):
+    """Returns (start, end) of the length delimited value at pos"""
+    length, start = read_varint(data, pos)
+    if start + length > len(data):
+        raise WireError("Truncated field")
+    return start, start + length
+
+def _decode_vector3(data, start, end):
+    x = y = z = 0.0
+    for number, wire_type, pos in fields(data, start, end):
+        if wire_type != FIXED64:
+            continue
+        value = struct.unpack_from('<d', data, pos)[0]
+        if number == 1:
+            x = value
+        elif number == 2:
+            y = value
+        elif number == 3:
+            z = value
+    return Vector(x, y, z)
+
+def _decode_state_value(data, start, end):
+    """Returns the unwrapped value of a StateValue, raising WireError for
+    values it doesn't handle (arrays)
+    """
+    state_type = None
+    values = {}
+    for number, wire_type, pos in fields(data, start, end):
+        if number == 1 and wire_type == VARINT:
+            state_type = read_varint(data, pos)[0]
+        elif number == 2 and wire_type == VARINT:
+            values[number] = bool(read_varint(data, pos)[0])
+        elif number == 3 and wire_type == VARINT:
+            values[number] = read_int32(data, pos)[0]
+        elif number == 4 and wire_type == FIXED32:
+            values[number] = struct.unpack_from('<f', data, pos)[0]
+        elif number == 5 and wire_type == LENGTH:
+            a, b = _length(data, pos)
+            values[number] = data[a:b].decode('utf-8')
+        elif number == 6 and wire_type == LENGTH:
+            values[number] = _decode_vector3(data, *_length(data, pos))
+        elif number == 15:
+            raise WireError("Arrays are not decoded from the wire")
+
+    if state_type not in STATE_DEFAULTS:
+        raise WireError("Unknown state type %r" % state_type)
+    number, default = STATE_DEFAULTS[state_type]
+    if number in values:
+        return values[number]
+    return default()
+
+def _decode_canonical(data):
+    """Decodes an UPDATESTATE Message laid out the way protobuf serializers
+    write it: fields in order, nothing unexpected. Returns None for
+    anything else.
+    """
+    if len(data) < 4:
+        return None
+    if data[0] != 0x08 or data[1] != ghack_pb2.Message.UPDATESTATE or data[2] != 0x22:
+        return None
+    start, end = _length(data, 3)
+    if end != len(data) or data[start] != 0x08:
+        return None
+    id, pos = read_int32(data, start + 1)
+    if data[pos] != 0x12:
+        return None
+    a, b = _length(data, pos + 1)
+    state_id = data[a:b].decode('utf-8')
+    if data[b] != 0x1a:
+        return None
+    start, end = _length(data, b + 1)
+    if end != len(data) or data[start] != 0x08:
+        return None
+
+    state_type = data[start + 1]
+    tag = data[start + 2] if start + 2 < end else None
+    pos = start + 3
+    if state_type == ghack_pb2.StateValue.VECTOR3 and tag == 0x32:
+        if data[pos] == 27 and data[pos + 1] == 0x09 and end == pos + 28:
+            value = Vector(*VECTOR3_STRUCT.unpack_from(data, pos + 2))
+        else:
+            return None
+    elif state_type == ghack_pb2.StateValue.FLOAT and tag == 0x25:
+        if end != pos + 4:
+            return None
+        value = struct.unpack_from('<f', data, pos)[0]
+    elif state_type == ghack_pb2.StateValue.INT and tag == 0x18:
+        value, pos = read_int32(data, pos)
+        if pos != end:
+            return None
+    elif state_type == ghack_pb2.StateValue.STRING and tag == 0x2a:
+        a, b = _length(data, pos)
+        if b != end:
+            return None
+        value = data[a:b].decode('utf-8')
+    else:
+        return None
+    return messages.StateUpdate(id, state_id, value)
+
+def decode_update_state(frame):
+    """Decodes a serialized UPDATESTATE Message straight into a
+    messages.StateUpdate, skipping the Message object graph. Returns
+    None if the frame has to be parsed the normal way instead.
+    """
+    data = bytearray(frame)
+    try:
+        update = _decode_canonical(data)
+        if update:
+            return update
+        for number, wire_type, pos in fields(data):
+            if number == 4 and wire_type == LENGTH:
+                start, end = _length(data, pos)
+                break
+        else:
+            return None
+
+        id = state_id = value = None
+        for number, wire_type, pos in fields(data, start, end):
+            if number == 1 and wire_type == VARINT:
+                id = read_int32(data, pos)[0]
+            elif number == 2 and wire_type == LENGTH:
+                a, b = _length(data, pos)
+                state_id = data[a:b].decode('utf-8')
+            elif number == 3 and wire_type == LENGTH:
+                value = _decode_state_value(data, *_length(data, pos))
+    except (WireError, struct.error, UnicodeDecodeError, IndexError):
+        return None
+
+    if id is None or state_id is None or value is None:
+        return None
+    return messages.StateUpdate(id, state_id, value)
+
+# StateValue type -> (field number, default value factory)
+STATE_DEFAULTS = {
+        ghack_pb2.StateValue.BOOL: (2, bool),
+        ghack_pb2.StateValue.INT: (3, int),
+        ghack_pb2.StateValue.FLOAT: (4, float),
+        ghack_pb2.StateValue.STRING: (5, unicode),
+        ghack_pb2.StateValue.VECTOR3: (6, Vector),
+    }
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Keeps the memory used by entity states within a budget. Every state
+except the ones needed to draw an entity is "cold", and when the cold
+states add up to more than the budget, those of entities far from the
+player are evicted in least recently updated order. An evicted state
+simply comes back with the next UpdateState for it.
+"""
+
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from debug import debug
+
+# States kept even for evicted entities, so they can still be drawn.
+# Health and MaxHealth stay together since MaxHealth is rarely resent.
+RESIDENT_STATES = frozenset(['Position', 'Asset', 'Health', 'MaxHealth'])
+# Default budget for cold states, in bytes
+DEFAULT_BUDGET = 32 * 1024 * 1024
+# Evict down to this fraction of the budget so it isn't hit again at once
+LOW_WATER = 0.8
+# Minimum seconds between eviction passes
+EVICT_INTERVAL = 1.0
+# Rough per state overhead of the states dict, in bytes
+DICT_ENTRY = 24
+
+def state_cost(state_id, value):
+    """Estimated bytes used by a single state"""
+    cost = DICT_ENTRY + sys.getsizeof(state_id) + sys.getsizeof(value)
+    if isinstance(value, list):
+        cost += sum(state_cost('', v) - DICT_ENTRY for v in value)
+    return cost
+
+def rss():
+    """Resident set size of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, IndexError, OSError):
+        pass
+    try:
+        import resource
+        # Only the peak is available here, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+class EntityCache(object):
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.size = 0 # estimated bytes of cold states
+        self.costs = {} # entity id -> estimated bytes of its cold states
+        self.recent = OrderedDict() # entity ids, least recently updated first
+        self.last_evict = 0
+        self.evictions = 0
+        self.evicted_states = 0
+
+    def touch(self, id, state_id, old, new):
+        """Account for a state of entity id changing from old to new"""
+        self.recent.pop(id, None)
+        self.recent[id] = None
+        if state_id in RESIDENT_STATES:
+            return
+        delta = state_cost(state_id, new) if new is not None else 0
+        if old is not None:
+            delta -= state_cost(state_id, old)
+        self.costs[id] = self.costs.get(id, 0) + delta
+        self.size += delta
+
+    def forget(self, id):
+        """Stop accounting for entity id, after it was removed or replaced"""
+        self.size -= self.costs.pop(id, 0)
+        self.recent.pop(id, None)
+
+    def evict(self, entities, center, radius, keep=None):
+        """Evict cold states of entities more than radius away from
+        center until under LOW_WATER of the budget, if over budget. The
+        entity with id keep is never evicted, and nothing is while the
+        center is unknown.
+        """
+        if self.size <= self.budget or center is None:
+            return
+        now = time.time()
+        if now - self.last_evict < EVICT_INTERVAL:
+            return
+        self.last_evict = now
+
+        target = self.budget * LOW_WATER
+        evicted = 0
+        for id in list(self.recent):
+            if self.size <= target:
+                break
+            if id == keep:
+                continue
+            entity = entities.get(id)
+            if entity is None:
+                self.forget(id)
+                continue
+            pos = entity.states.get('Position')
+            if pos is not None and \
+                    abs(pos.x - center.x) <= radius and \
+                    abs(pos.y - center.y) <= radius:
+                continue
+            for state_id in entity.states.keys():
+                if state_id not in RESIDENT_STATES:
+                    del entity.states[state_id]
+                    self.evicted_states += 1
+            self.forget(id)
+            evicted += 1
+
+        self.evictions += evicted
+        debug("Evicted cold states of %d entities, %d bytes left, rss %s" %
+                (evicted, self.size, rss()))
+
+    def as_dict(self):
+        return {'budget': self.budget, 'size': self.size,
+                'entities': len(self.recent), 'evictions': self.evictions,
+                'evicted_states': self.evicted_states, 'rss': rss()}
@@ -14,9 +14,46 @@ implementing the actual gameplay logic
 import curses
 import sys
 import os
+import time
 
 from debug import debug
 from objects import Entity, Vector
+from overview import Overview
+from cache import EntityCache, DEFAULT_BUDGET
+
+# Most keys drained from curses in a single frame
+MAX_KEYS_PER_FRAME = 64
+
+def _build_keymap():
+    """Precompute keycode -> action. Movement actions are (x, y) tuples,
+    anything else names a Game method taking no arguments.
+    """
+    bindings = [
+        # Cardinal directions
+        ((0,-1), [curses.KEY_UP, 'k', '8']),
+        ((0,1), [curses.KEY_DOWN, 'j', '2']),
+        ((-1,0), [curses.KEY_LEFT, 'h', '4']),
+        ((1,0), [curses.KEY_RIGHT, 'l', '6']),
+        # Diagonals
+        ((-1,-1), [curses.KEY_HOME, 'y', '7']),
+        ((1,-1), [curses.KEY_PPAGE, 'u', '9']),
+        ((-1,1), [curses.KEY_NPAGE, 'b', '1']),
+        ((1,1), [curses.KEY_END, 'n', '3']),
+        # Others
+        ('create_hud', [curses.KEY_RESIZE]),
+        ('dump_entities', ['g']),
+        ('toggle_overview', ['o']),
+        ('zoom_in', ['+', '=']),
+        ('zoom_out', ['-']),
+        ('quit', ['q']),
+    ]
+    keymap = {}
+    for action, keys in bindings:
+        for key in keys:
+            keymap[ord(key) if isinstance(key, str) else key] = action
+    return keymap
+
+KEYMAP = _build_keymap()
 
 class HealthBar:
     def __init__(self, capacity = 10, width = 12):
@@ -41,16 +78,21 @@ class HealthBar:
         return str(self.bar)
 
 class Game(object):
-    def __init__(self, name):
+    def __init__(self, name, memory_budget=DEFAULT_BUDGET):
         self.name = name
         self.entities = {}
+        self.cache = EntityCache(memory_budget)
         self.direction = Vector()
+        self.direction_time = None # when the pending direction was input
         self.healthbar = HealthBar()
         self.player = None
         self.HUD_WIDTH = 30
         self.MSG_LINES = 5 # num lines for message area
         self.messages = []
         self.kills = 0
+        self.rtt = None # (p50, p95, p99) move round trip, in seconds
+        self.tick_interval = None
+        self.overview = Overview()
 
         self._init_curses()
 
@@ -76,24 +118,42 @@ class Game(object):
         self.running = True
         self.redraw()
         self._handle_input()
+        self._evict()
+
+    def _evict(self):
+        """Evict cold states of entities that are off screen"""
+        player = self.get_player()
+        center = player.states.get('Position') if player else None
+        maxy, maxx = self.scr.getmaxyx()
+        self.cache.evict(self.entities, center, max(maxy, maxx), self.player)
 
     def add_entity(self, id, name=None):
         if id in self.entities:
             debug("Entity id %d added twice" % id)
         self.entities[id] = Entity(id, name)
+        self.cache.forget(id)
+        self.overview.add(id)
 
     def remove_entity(self, id, name=None):
         if id not in self.entities:
             debug("Entity id %d removed without being added" % id)
             return
         del self.entities[id]
+        self.cache.forget(id)
+        self.overview.remove(id)
 
     def update_entity(self, id, state_id, value=None):
         if id not in self.entities:
             debug("Entity id %d updated without being added" % id)
             return
-        self.entities[id].set_state(state_id, value)
-        self.redraw()
+        entity = self.entities[id]
+        self.cache.touch(id, state_id, entity.states.get(state_id), value)
+        entity.set_state(state_id, value)
+        if state_id == 'Position':
+            self.overview.set_position(id, value)
+        elif state_id == 'Health' or state_id == 'MaxHealth':
+            self.overview.set_health(id, entity.states.get('Health'),
+                    entity.states.get('MaxHealth'))
 
     def assign_control(self, uid, revoked):
         self.player = uid if not revoked else None
@@ -108,6 +168,10 @@ class Game(object):
     def combat_hit(self, auid, aname, vuid, vname, damage):
         self.add_message("%s hit %s for %d damage!" % (aname, vname, damage))
 
+    def set_latency(self, rtt, tick_interval):
+        self.rtt = rtt
+        self.tick_interval = tick_interval
+
     def get_player(self):
         if self.player != None:
             if self.entities.has_key(self.player):
@@ -117,7 +181,7 @@ class Game(object):
     def create_hud(self):
         y,x = self.scr.getmaxyx()
         try:
-            self.hudwin = curses.newwin(5,self.HUD_WIDTH,1,x-self.HUD_WIDTH-1)
+            self.hudwin = curses.newwin(6,self.HUD_WIDTH,1,x-self.HUD_WIDTH-1)
             self.hudwin.nodelay(1)
             self.msgwin = curses.newwin(self.MSG_LINES,x-2,y-self.MSG_LINES-1,1)
             self.msgwin.nodelay(1)
@@ -150,6 +214,14 @@ class Game(object):
             self.hudwin.addstr(1,10+hpstrlen,str(self.healthbar),curses.color_pair(1))
             self.hudwin.addstr(2,1,"Kills:",curses.color_pair(1)| curses.A_BOLD)
             self.hudwin.addstr(2,9,str(self.kills),curses.color_pair(1))
+            self.hudwin.addstr(3,1,"Lag:",curses.color_pair(1)| curses.A_BOLD)
+            if self.rtt:
+                lag = "%d/%d/%dms" % tuple(t * 1000 for t in self.rtt)
+                self.hudwin.addstr(3,9,lag,curses.color_pair(1))
+            self.hudwin.addstr(4,1,"Tick:",curses.color_pair(1)| curses.A_BOLD)
+            if self.tick_interval:
+                tick = "%dms" % (self.tick_interval * 1000)
+                self.hudwin.addstr(4,9,tick,curses.color_pair(1))
             self.hudwin.border()
         except curses.error:
             sys.stderr.write("HUD cannot be drawn!\n")
@@ -184,13 +256,19 @@ class Game(object):
         offsety = offsetx = 0
         maxy, maxx = self.scr.getmaxyx()
         midy, midx = maxy/2, maxx/2
+        center = Vector()
         player = self.get_player()
         if player and 'Position' in player.states:
-            pos = player.states['Position']
+            pos = center = player.states['Position']
             offsety,offsetx = midy-pos.y,midx-pos.x
 
+        if self.overview.enabled:
+            self.overview.draw(self.scr, center)
+            entities = []
+        else:
+            entities = self.entities.values()
 
-        for entity in self.entities.values():
+        for entity in entities:
             #print(entity.name, entity.states)
             if entity.states.has_key('Position'):
                 pos = entity.states['Position']
@@ -212,8 +290,11 @@ class Game(object):
                             sys.stderr.write("Failed to draw asset %s at y,x=%d,%d\n" %
                                 (asset, int(posy), int(posx)))
         self.scr.border()
+        title = "GHack SpiderForest"
+        if self.overview.enabled:
+            title += " [1:%d]" % self.overview.scale()
         try:
-            self.scr.addstr(0,max(midx-9,0),"GHack SpiderForest",curses.color_pair(1))
+            self.scr.addstr(0,max(midx-len(title)/2,0),title,curses.color_pair(1))
         except curses.error:
             print("oh no!")
 
@@ -224,37 +305,63 @@ class Game(object):
         curses.doupdate()
 
     def _handle_input(self):
-        ch = self.scr.getch()
-        # Cardinal directions
-        if ch == curses.KEY_UP or ch == ord('k') or ch == ord('8'):
-            self.move(0,-1)
-        elif ch == curses.KEY_DOWN or ch == ord('j') or ch == ord('2'):
-            self.move(0,1)
-        elif ch == curses.KEY_LEFT or ch == ord('h') or ch == ord('4'):
-            self.move(-1,0)
-        elif ch == curses.KEY_RIGHT or ch == ord('l') or ch == ord('6'):
-            self.move(1,0)
-        # Diagonals
-        elif ch == curses.KEY_HOME or ch == ord('y') or ch == ord('7'):
-            self.move(-1,-1)
-        elif ch == curses.KEY_PPAGE or ch == ord('u') or ch == ord('9'):
-            self.move(1,-1)
-        elif ch == curses.KEY_NPAGE or ch == ord('b') or ch == ord('1'):
-            self.move(-1,1)
-        elif ch == curses.KEY_END or ch == ord('n') or ch == ord('3'):
-            self.move(1,1)
-        # Others
-        elif ch == curses.KEY_RESIZE:
-            self.create_hud()
-        elif ch == ord('g'):
-            for entity in self.entities.values():
-                sys.stderr.write(str(entity.id) + str(entity.name)+str(entity.states)+"\n")
-        elif ch == ord('q'):
-            self.running = False
+        """Drain every pending key and merge all movement keys into a
+        single intent, so key repeat bursts don't queue up behind us
+        """
+        dx = dy = 0
+        moved = False
+        for i in xrange(MAX_KEYS_PER_FRAME):
+            ch = self.scr.getch()
+            if ch == -1:
+                break
+            action = KEYMAP.get(ch)
+            if action is None:
+                continue
+            if isinstance(action, tuple):
+                dx += action[0]
+                dy += action[1]
+                moved = True
+            else:
+                getattr(self, action)()
+
+        if moved:
+            # Opposing keys cancel out, repeats don't add up
+            self.move(cmp(dx, 0), cmp(dy, 0))
+
+    def dump_entities(self):
+        for entity in self.entities.values():
+            sys.stderr.write(str(entity.id) + str(entity.name)+str(entity.states)+"\n")
+
+    def toggle_overview(self):
+        self.overview.toggle()
+
+    def zoom_in(self):
+        self.overview.zoom_in()
+
+    def zoom_out(self):
+        self.overview.zoom_out()
+
+    def quit(self):
+        self.running = False
 
     def move(self, x, y):
         """Sending commands is weird. For now, just save it somewhere for
         the network to pick up
         """
 
+        if not (x or y):
+            self.direction_time = None
+        elif self.direction_time is None:
+            # Keep the first press while an intent is pending, so held
+            # keys still go stale and latency counts from the first press
+            self.direction_time = time.time()
         self.direction = Vector(x, y)
+
+    def take_direction(self):
+        """Hand the pending direction over to the network, returning it
+        along with the time it was input
+        """
+        direction, when = self.direction, self.direction_time
+        self.direction = Vector()
+        self.direction_time = None
+        return direction, when
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+A zoomed out overview map. Entity positions and health are mirrored into
+flat NumPy arrays as updates arrive, so that drawing the map only needs a
+handful of vectorised operations no matter how many entities exist.
+"""
+
+import curses
+import sys
+
+import numpy
+
+# World tiles per screen cell for each zoom level
+ZOOM_LEVELS = [2, 4, 8, 16, 32, 64]
+
+# Glyphs for increasing entity density, picked on a log scale
+DENSITY_GLYPHS = '.:+*#%'
+
+class Overview(object):
+    def __init__(self, capacity=1024):
+        self.enabled = False
+        self.zoom = 0
+        self.slots = {} # entity id -> row in the arrays below
+        self.free = []
+        self.size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """Grow the backing arrays to hold capacity entities"""
+        pos = numpy.zeros((capacity, 2))
+        health = numpy.ones(capacity)
+        placed = numpy.zeros(capacity, dtype=bool)
+        if self.size:
+            pos[:self.size] = self.pos[:self.size]
+            health[:self.size] = self.health[:self.size]
+            placed[:self.size] = self.placed[:self.size]
+        self.pos, self.health, self.placed = pos, health, placed
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def zoom_in(self):
+        self.zoom = max(self.zoom - 1, 0)
+
+    def zoom_out(self):
+        self.zoom = min(self.zoom + 1, len(ZOOM_LEVELS) - 1)
+
+    def scale(self):
+        return ZOOM_LEVELS[self.zoom]
+
+    def add(self, id):
+        if id in self.slots:
+            slot = self.slots[id]
+        elif self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == len(self.placed):
+                self._allocate(len(self.placed) * 2)
+            slot = self.size
+            self.size += 1
+        self.slots[id] = slot
+        self.placed[slot] = False
+        self.health[slot] = 1.0
+
+    def remove(self, id):
+        slot = self.slots.pop(id, None)
+        if slot is not None:
+            self.placed[slot] = False
+            self.free.append(slot)
+
+    def set_position(self, id, pos):
+        slot = self.slots.get(id)
+        if slot is None:
+            return
+        if pos is None:
+            self.placed[slot] = False
+            return
+        self.pos[slot] = pos.x, pos.y
+        self.placed[slot] = True
+
+    def set_health(self, id, hp, maxhp):
+        slot = self.slots.get(id)
+        if slot is None:
+            return
+        if hp is None or not maxhp:
+            self.health[slot] = 1.0
+        else:
+            self.health[slot] = hp / float(maxhp)
+
+    def bin(self, center, rows, cols):
+        """Bin all placed entities into a rows x cols grid centered on
+        center. Returns per cell entity counts and mean health fraction.
+        """
+        cells = rows * cols
+        placed = self.placed[:self.size]
+        pos = self.pos[:self.size][placed]
+        health = self.health[:self.size][placed]
+
+        scale = float(self.scale())
+        cx = numpy.floor((pos[:, 0] - center.x) / scale).astype(int) + cols // 2
+        cy = numpy.floor((pos[:, 1] - center.y) / scale).astype(int) + rows // 2
+        inside = (cx >= 0) & (cx < cols) & (cy >= 0) & (cy < rows)
+        flat = cy[inside] * cols + cx[inside]
+
+        counts = numpy.bincount(flat, minlength=cells)
+        health_sum = numpy.bincount(flat, weights=health[inside], minlength=cells)
+        mean_health = health_sum / numpy.maximum(counts, 1)
+        return counts.reshape(rows, cols), mean_health.reshape(rows, cols)
+
+    def draw(self, scr, center):
+        """Draw the overview inside the border of scr"""
+        maxy, maxx = scr.getmaxyx()
+        rows, cols = maxy - 2, maxx - 2
+        if rows <= 0 or cols <= 0:
+            return
+        counts, health = self.bin(center, rows, cols)
+
+        # Glyph index grows with log2 of the density
+        level = numpy.log2(numpy.maximum(counts, 1)).astype(int)
+        level = numpy.minimum(level, len(DENSITY_GLYPHS) - 1)
+        color = numpy.where(health < 0.33, 6, numpy.where(health < 0.66, 5, 4))
+
+        ys, xs = numpy.nonzero(counts)
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            try:
+                scr.addstr(y + 1, x + 1, DENSITY_GLYPHS[level[y, x]],
+                        curses.color_pair(int(color[y, x])))
+            except curses.error:
+                sys.stderr.write("Failed to draw overview cell y,x=%d,%d\n" %
+                    (y + 1, x + 1))
+        try:
+            scr.addstr(rows // 2 + 1, cols // 2 + 1, '@',
+                    curses.color_pair(1) | curses.A_BOLD)
+        except curses.error:
+            pass
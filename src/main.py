@@ -40,6 +40,8 @@ import debug
 
 # sleep 00ms between updates
 UPDATE_DELAY = 0.003
+# seconds per frame spent applying messages from the server
+APPLY_BUDGET = 0.010
 
 def gameloop(game, client):
     def inner(last_frame):
@@ -48,6 +50,7 @@ def gameloop(game, client):
             return
         this_frame = time.time()
         delta = this_frame - last_frame
+        client.conn.pump(APPLY_BUDGET)
         if client.connected:
             game.update(delta)
             client.update(delta)
@@ -57,12 +60,14 @@ def gameloop(game, client):
     game.running = True
     inner(last_frame)
 
-def run(host, port, name):
-    game = Game(name)
+def run(host, port, name, stats_file=None, memory_budget=32):
+    game = Game(name, memory_budget * 1024 * 1024)
     client = Client(game)
+    client.stats_file = stats_file
 
     def on_connected(protocol):
         protocol.callback = lambda msg: client.handle(msg)
+        protocol.pipeline.wanted = client.wants
         client.conn = protocol
         client.run()
         gameloop(game, client)
@@ -79,7 +84,8 @@ def cleanup():
 def main(options, args):
     debug.verbose = options.verbose
     #(run,options.host,int(options.port),options.name)
-    run(options.host, int(options.port), options.name)
+    run(options.host, int(options.port), options.name, options.stats,
+            float(options.memory_budget))
 
 if __name__ == '__main__':
     parser = OptionParser()
@@ -92,6 +98,12 @@ if __name__ == '__main__':
     parser.add_option('-n', '--name',
             help='Player name',
             default='pyClient')
+    parser.add_option('--stats',
+            help='Periodically write network and memory stats as JSON to this file',
+            default=None)
+    parser.add_option('--memory-budget',
+            help='Megabytes of entity state kept before evicting far away entities',
+            default='32')
     parser.add_option('-v', '--verbose',
             help='Player name',
             action='store_true',
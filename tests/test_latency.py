@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Checks the move round trip and tick interval estimates in client.latency.
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from client.latency import LatencyTracker
+from game.objects import Vector
+
+RIGHT = Vector(1, 0)
+DOWN = Vector(0, 1)
+
+class RoundTripTest(unittest.TestCase):
+    def assertRtt(self, tracker, rtt):
+        for pct in tracker.rtt.percentiles():
+            self.assertAlmostEqual(pct, rtt)
+
+    def test_rtt_longer_than_move_interval(self):
+        # Key held down: a move every 100ms, each echoed 250ms later
+        tracker = LatencyTracker()
+        tracker.position_updated(0.0, Vector(0, 0))
+        events = []
+        for i in range(20):
+            sent = 1.0 + i * 0.1
+            events.append((sent, 'send', None))
+            events.append((sent + 0.25, 'echo', Vector(i + 1, 0)))
+        for when, kind, pos in sorted(events):
+            if kind == 'send':
+                tracker.move_sent(when, RIGHT)
+            else:
+                tracker.position_updated(when, pos)
+        self.assertEqual(tracker.rtt.count, 20)
+        self.assertRtt(tracker, 0.25)
+        self.assertEqual(tracker.moves_lost, 0)
+
+    def test_move_into_wall_not_matched(self):
+        tracker = LatencyTracker()
+        tracker.position_updated(0.0, Vector(0, 0))
+        tracker.move_sent(1.0, RIGHT) # blocked, never echoed
+        tracker.move_sent(1.5, DOWN)
+        tracker.position_updated(1.55, Vector(0, 1))
+        self.assertRtt(tracker, 0.05)
+        self.assertEqual(tracker.moves_lost, 1)
+
+    def test_unchanged_position_is_no_echo(self):
+        tracker = LatencyTracker()
+        tracker.position_updated(0.0, Vector(0, 0))
+        tracker.move_sent(1.0, RIGHT)
+        tracker.position_updated(1.05, Vector(0, 0))
+        self.assertEqual(tracker.rtt.percentiles(), None)
+        self.assertEqual(len(tracker.pending), 1)
+
+    def test_old_moves_expire(self):
+        tracker = LatencyTracker()
+        tracker.position_updated(0.0, Vector(0, 0))
+        tracker.move_sent(1.0, RIGHT)
+        tracker.move_sent(5.0, RIGHT)
+        tracker.position_updated(5.1, Vector(1, 0))
+        self.assertRtt(tracker, 0.1)
+        self.assertEqual(tracker.moves_lost, 1)
+
+class TickIntervalTest(unittest.TestCase):
+    def test_idle_gaps_ignored(self):
+        tracker = LatencyTracker()
+        now = 0.0
+        for gap in [3, 5, 2, 4, 6]:
+            now += gap
+            tracker.update_received(now)
+        self.assertEqual(tracker.tick_interval(), None)
+
+    def test_steady_ticks(self):
+        tracker = LatencyTracker()
+        now = 0.0
+        for i in range(20):
+            now += 0.1
+            tracker.update_received(now)
+            tracker.update_received(now + 0.001) # same tick
+        now += 0.9 # world went quiet for a bit
+        tracker.update_received(now)
+        self.assertAlmostEqual(tracker.tick_interval(), 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
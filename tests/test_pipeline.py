@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Checks how client.pipeline.collapse thins out a backlog when catching up,
+and which messages the decode worker leaves unparsed.
+Needs the generated protocol_pb2 (see build.sh):
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from proto import protocol_pb2 as ghack_pb2
+from client import messages
+from client.pipeline import DecodePipeline, collapse
+
+def add(id):
+    msg = ghack_pb2.Message()
+    msg.type = ghack_pb2.Message.ADDENTITY
+    msg.add_entity.id = id
+    return msg
+
+def remove(id):
+    msg = ghack_pb2.Message()
+    msg.type = ghack_pb2.Message.REMOVEENTITY
+    msg.remove_entity.id = id
+    return msg
+
+def update(id, state_id, value):
+    msg = ghack_pb2.Message()
+    msg.type = ghack_pb2.Message.UPDATESTATE
+    msg.update_state.id = id
+    msg.update_state.state_id = state_id
+    msg.update_state.value.type = ghack_pb2.StateValue.INT
+    msg.update_state.value.int_val = value
+    return msg
+
+def control(uid):
+    msg = ghack_pb2.Message()
+    msg.type = ghack_pb2.Message.ASSIGNCONTROL
+    msg.assign_control.uid = uid
+    return msg
+
+def describe(msg):
+    """Short description of a message to compare against"""
+    if msg.type == ghack_pb2.Message.ADDENTITY:
+        return ('add', msg.add_entity.id)
+    elif msg.type == ghack_pb2.Message.REMOVEENTITY:
+        return ('remove', msg.remove_entity.id)
+    elif msg.type == ghack_pb2.Message.UPDATESTATE:
+        u = msg.update_state
+        return ('update', u.id, u.state_id, u.value.int_val)
+    return ('other', msg.type)
+
+def run(msgs):
+    kept, superseded, removed = collapse(list(enumerate(msgs)))
+    # Received times are the original indices, they must stay ascending
+    times = [received for received, msg in kept]
+    assert times == sorted(times)
+    return [describe(msg) for received, msg in kept], superseded, removed
+
+class CollapseTest(unittest.TestCase):
+    def test_last_write_wins(self):
+        kept, superseded, removed = run([
+                add(1),
+                update(1, u'Position', 1),
+                update(1, u'Health', 10),
+                update(1, u'Position', 2),
+                update(1, u'Position', 3),
+            ])
+        self.assertEqual(kept, [('add', 1), ('update', 1, u'Health', 10),
+                ('update', 1, u'Position', 3)])
+        self.assertEqual((superseded, removed), (2, 0))
+
+    def test_states_and_entities_are_separate(self):
+        kept, superseded, removed = run([
+                update(1, u'Position', 1),
+                update(2, u'Position', 2),
+                update(1, u'Health', 3),
+            ])
+        self.assertEqual(len(kept), 3)
+        self.assertEqual((superseded, removed), (0, 0))
+
+    def test_removed_later_drops_updates(self):
+        kept, superseded, removed = run([
+                add(1),
+                update(1, u'Position', 1),
+                update(1, u'Health', 5),
+                remove(1),
+            ])
+        self.assertEqual(kept, [('add', 1), ('remove', 1)])
+        self.assertEqual((superseded, removed), (0, 2))
+
+    def test_readded_keeps_only_new_updates(self):
+        kept, superseded, removed = run([
+                update(1, u'Position', 1),
+                remove(1),
+                add(1),
+                update(1, u'Position', 2),
+                update(1, u'Position', 3),
+            ])
+        self.assertEqual(kept, [('remove', 1), ('add', 1),
+                ('update', 1, u'Position', 3)])
+        self.assertEqual((superseded, removed), (1, 1))
+
+    def test_add_remove_order_kept(self):
+        msgs = [add(1), add(2), remove(1), control(2), add(1), remove(2),
+                remove(1), add(3)]
+        kept, superseded, removed = run(msgs)
+        self.assertEqual(kept, [describe(msg) for msg in msgs])
+        self.assertEqual((superseded, removed), (0, 0))
+
+    def test_empty(self):
+        self.assertEqual(collapse([]), ([], 0, 0))
+
+class DeferTest(unittest.TestCase):
+    def test_unwanted_types_parsed_lazily(self):
+        pipeline = DecodePipeline()
+        pipeline.wanted = lambda msg_type: msg_type != ghack_pb2.Message.DISCONNECT
+        msg = messages.disconnect(ghack_pb2.Disconnect.KICKED, u'bye')
+        decoded = pipeline.decode(msg.SerializeToString())
+        pipeline.stop()
+
+        self.assertTrue(isinstance(decoded, messages.LazyMessage))
+        self.assertEqual(decoded.type, ghack_pb2.Message.DISCONNECT)
+        str(decoded) # logging it must not parse it
+        self.assertEqual(decoded._msg, None)
+        self.assertEqual(decoded.disconnect.reason_str, u'bye')
+
+    def test_wanted_types_parsed(self):
+        pipeline = DecodePipeline()
+        pipeline.wanted = lambda msg_type: msg_type != ghack_pb2.Message.DISCONNECT
+        decoded = pipeline.decode(add(1).SerializeToString())
+        pipeline.stop()
+        self.assertFalse(isinstance(decoded, messages.LazyMessage))
+        self.assertEqual(decoded.add_entity.id, 1)
+
+if __name__ == '__main__':
+    unittest.main()
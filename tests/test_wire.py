@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2010, 2011 The ghack Authors. All rights reserved.
+# Use of this source code is governed by the GNU General Public License
+# version 3 (or any later version). See the file COPYING for details.
+
+"""
+Checks the hand written UpdateState decoder in client.wire against the
+protobuf parser. Needs the generated protocol_pb2 (see build.sh):
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from proto import protocol_pb2 as ghack_pb2
+from client import messages, wire
+from client.pipeline import DecodePipeline
+
+def update(id, state_id, state_type, **value):
+    msg = ghack_pb2.Message()
+    msg.type = ghack_pb2.Message.UPDATESTATE
+    msg.update_state.id = id
+    msg.update_state.state_id = state_id
+    msg.update_state.value.type = state_type
+    for field, val in value.items():
+        if field == 'vector3_val':
+            vec = msg.update_state.value.vector3_val
+            vec.x, vec.y, vec.z = val
+        else:
+            setattr(msg.update_state.value, field, val)
+    return msg
+
+def plain(value):
+    """Vectors don't compare equal, turn them into tuples"""
+    if hasattr(value, 'x'):
+        return (value.x, value.y, value.z)
+    return value
+
+StateValue = ghack_pb2.StateValue
+
+CASES = [
+        update(1, u'Alive', StateValue.BOOL, bool_val=True),
+        update(1, u'Alive', StateValue.BOOL, bool_val=False),
+        update(2, u'Kills', StateValue.INT, int_val=12345),
+        update(2, u'Kills', StateValue.INT, int_val=-7),
+        update(2, u'Kills', StateValue.INT, int_val=-2 ** 31),
+        update(3, u'Health', StateValue.FLOAT, float_val=7.25),
+        update(3, u'Health', StateValue.FLOAT, float_val=-0.5),
+        update(4, u'Asset', StateValue.STRING, string_val=u'S'),
+        update(4, u'Asset', StateValue.STRING, string_val=u''),
+        update(4, u'Asset', StateValue.STRING, string_val=u'ü✓'),
+        update(5, u'Position', StateValue.VECTOR3,
+            vector3_val=(1.5, -2.0, 1e9)),
+        update(5, u'Position', StateValue.VECTOR3, vector3_val=(0, 0, 0)),
+        update(-1, u'Position', StateValue.VECTOR3, vector3_val=(3, 4, 0)),
+        update(-2 ** 31, u'Health', StateValue.FLOAT, float_val=1.0),
+        update(2 ** 31 - 1, u'', StateValue.INT, int_val=0),
+        update(6, u'Ŝtate', StateValue.STRING, string_val=u'x'),
+        # Type set, value left unset
+        update(7, u'Alive', StateValue.BOOL),
+        update(7, u'Kills', StateValue.INT),
+        update(7, u'Health', StateValue.FLOAT),
+        update(7, u'Asset', StateValue.STRING),
+        update(7, u'Position', StateValue.VECTOR3),
+    ]
+
+class DecodeUpdateStateTest(unittest.TestCase):
+    def test_matches_protobuf(self):
+        for msg in CASES:
+            frame = msg.SerializeToString()
+            parsed = ghack_pb2.Message()
+            parsed.ParseFromString(frame)
+            expected = parsed.update_state
+
+            decoded = wire.decode_update_state(frame)
+            self.assertTrue(decoded is not None, str(msg))
+            self.assertEqual(decoded.id, expected.id)
+            self.assertEqual(decoded.state_id, expected.state_id)
+            value = messages.unwrap_state(expected.value)
+            self.assertEqual(plain(decoded.value), plain(value))
+            self.assertEqual(type(plain(decoded.value)), type(plain(value)))
+
+    def test_peek_type(self):
+        for msg in CASES + [messages.connect(1), messages.login(u'x')]:
+            self.assertEqual(wire.peek_type(msg.SerializeToString()), msg.type)
+        self.assertEqual(wire.peek_type(''), None)
+        self.assertEqual(wire.peek_type('\xff'), None)
+
+    def test_arrays_fall_back(self):
+        msg = update(1, u'List', StateValue.ARRAY)
+        msg.update_state.value.array_val.add(type=StateValue.INT, int_val=1)
+        self.assertEqual(wire.decode_update_state(msg.SerializeToString()), None)
+
+    def test_truncated_frames(self):
+        for msg in CASES:
+            frame = msg.SerializeToString()
+            for end in range(len(frame)):
+                # Must never raise, the normal parser gets the last word
+                wire.decode_update_state(frame[:end])
+
+    def test_missing_update_state(self):
+        msg = ghack_pb2.Message()
+        msg.type = ghack_pb2.Message.UPDATESTATE
+        frame = msg.SerializeToString()
+        self.assertEqual(wire.decode_update_state(frame), None)
+        pipeline = DecodePipeline()
+        decoded = pipeline.decode(frame)
+        self.assertEqual(decoded.type, ghack_pb2.Message.UPDATESTATE)
+        self.assertFalse(decoded.HasField('update_state'))
+        pipeline.stop()
+
+    def test_str_with_unicode(self):
+        for msg in CASES:
+            str(wire.decode_update_state(msg.SerializeToString()))
+
+if __name__ == '__main__':
+    unittest.main()